@@ -1,11 +1,180 @@
-import json
+import orjson
+import numpy as np
 import pandas as pd
 import os
 import math
+import calendar
+import multiprocessing as mp
 from datetime import datetime
-from collections import Counter, defaultdict
+from collections import ChainMap
 from tqdm import tqdm
 
+# user_object_diversity용 obj_type 비트 (node/way/relation)
+_TYPE_BIT = {"node": 1, "way": 2, "relation": 4}
+
+# fork된 워커 프로세스가 copy-on-write로 물려받는 extractor 인스턴스
+_POOL_EXTRACTOR = None
+
+
+def _extract_chunk(chunk):
+    """워커 프로세스에서 레코드 chunk 하나를 처리 (IPC 비용 분산용)."""
+    results = []
+    for curr in chunk:
+        try:
+            results.append(_POOL_EXTRACTOR.extract_row(curr))
+        except Exception:
+            continue
+    return results
+
+# pyarrow가 있으면 CSV 쓰기를 C++ 멀티스레드 writer로 처리 (없으면 pandas to_csv)
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+except ImportError:
+    pa = None
+
+
+# 지구 반경 (m) — haversine 계열 함수들이 공유
+_EARTH_R = 6371000.0
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    """두 위경도 사이 거리(m). 스칼라 버전 (centroid shift 등 단건 계산용)."""
+    if lat1 is None or lat2 is None or lon1 is None or lon2 is None:
+        return 0.0
+
+    R = _EARTH_R
+    try:
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        dphi = math.radians(lat2 - lat1)
+        dlambda = math.radians(lon2 - lon1)
+
+        a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        return R * c
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def _haversine_arr(lat1, lon1, lat2, lon2):
+    """배열 단위 haversine (m). 모든 인자는 같은 길이의 ndarray."""
+    R = _EARTH_R
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = np.radians(lat2 - lat1)
+    dlambda = np.radians(lon2 - lon1)
+
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+
+# extract_row가 반환하는 튜플의 컬럼 순서와 저장 dtype
+# (dict 리스트 대신 typed ndarray 컬럼으로 DataFrame을 조립하기 위한 스키마)
+_FEATURE_DTYPES = [
+    ("changeset_id", np.int64), ("obj_id", np.int64),
+    ("object_type", np.int8), ("version_count", np.int32),
+    ("is_delete", np.int8), ("is_create", np.int8), ("is_modify", np.int8),
+    ("last_modified_time", np.int64), ("created_time", np.int64),
+    ("tag_count", np.int32), ("tag_add_count", np.int32),
+    ("tag_remove_count", np.int32), ("tag_modify_count", np.int32),
+    ("name_changed", np.int8),
+    ("length_change_ratio", np.float64), ("area_change_ratio", np.float64),
+    ("node_count_change", np.int32), ("centroid_shift", np.float64),
+    ("uid", np.int64), ("time_gap_prev", np.int64),
+]
+
+
+# equirectangular 투영 상수 (y: 위도 1도당 m, x: 경도 1도당 m * cos(lat))
+_LAT_SCALE = 111320.0
+_LON_SCALE = 40075000.0 / 360.0
+
+
+def _way_metrics_numpy(lats, lons, closed):
+    """NumPy 벡터 연산으로 length/area/centroid를 계산 (numba 미설치 시 기본 경로)."""
+    # radians/cos는 length(haversine)와 area(투영)가 공유하므로 한 번만 계산
+    rad_lats = np.radians(lats)
+    cos_lats = np.cos(rad_lats)
+
+    # length: 인접 정점 쌍 전체를 벡터 연산으로 처리 (haversine 인라인)
+    dphi = rad_lats[1:] - rad_lats[:-1]
+    dlambda = np.radians(lons[1:] - lons[:-1])
+    a = np.sin(dphi / 2) ** 2 + cos_lats[:-1] * cos_lats[1:] * np.sin(dlambda / 2) ** 2
+    length_m = float((2 * _EARTH_R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))).sum())
+
+    # centroid
+    cent_lat = float(lats.mean())
+    cent_lon = float(lons.mean())
+
+    # area: 폐곡선일 때만 계산 (open way의 area는 노이즈)
+    area_m2 = 0.0
+    if closed and len(lats) >= 3:
+        # equirectangular 투영 (cos는 위에서 계산한 배열 재사용)
+        y = lats * _LAT_SCALE
+        x = lons * _LON_SCALE * cos_lats
+
+        # 원점에서 먼 좌표의 cancellation을 줄이기 위해 중심을 빼고 계산
+        # (shoelace는 평행이동에 불변)
+        x = x - x.mean()
+        y = y - y.mean()
+
+        # Shoelace: 두 번의 generator 합 대신 단일 dot 기반 cross-sum
+        area_m2 = 0.5 * abs(float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))))
+
+    return length_m, area_m2, cent_lat, cent_lon
+
+
+def _way_metrics_loop(lats, lons, closed):
+    """단일 루프 버전 커널. numba가 있으면 njit 컴파일되어 이 경로를 쓴다."""
+    n = lats.shape[0]
+
+    length_m = 0.0
+    sum_lat = 0.0
+    sum_lon = 0.0
+    R = _EARTH_R
+
+    for i in range(n):
+        sum_lat += lats[i]
+        sum_lon += lons[i]
+        if i < n - 1:
+            phi1 = math.radians(lats[i])
+            phi2 = math.radians(lats[i + 1])
+            dphi = math.radians(lats[i + 1] - lats[i])
+            dlambda = math.radians(lons[i + 1] - lons[i])
+            a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+            length_m += R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    cent_lat = sum_lat / n
+    cent_lon = sum_lon / n
+
+    area_m2 = 0.0
+    if closed and n >= 3:
+        x = np.empty(n, dtype=np.float64)
+        y = np.empty(n, dtype=np.float64)
+        for i in range(n):
+            y[i] = lats[i] * _LAT_SCALE
+            x[i] = lons[i] * _LON_SCALE * math.cos(math.radians(lats[i]))
+
+        x -= x.mean()
+        y -= y.mean()
+
+        cross = 0.0
+        for i in range(n):
+            j = (i + 1) % n
+            cross += x[i] * y[j] - y[i] * x[j]
+        area_m2 = 0.5 * abs(cross)
+
+    return length_m, area_m2, cent_lat, cent_lon
+
+
+# numba가 설치돼 있으면 루프 커널을 JIT 컴파일해서 쓰고, 없으면 NumPy 경로로 동작
+try:
+    from numba import njit
+
+    _way_metrics_kernel = njit(cache=True, fastmath=True)(_way_metrics_loop)
+except ImportError:
+    _way_metrics_kernel = _way_metrics_numpy
+
 
 class LGBMFeatureExtractor:
     """
@@ -31,48 +200,67 @@ class LGBMFeatureExtractor:
         # (obj_type, obj_id, version) -> prev record
         self.prev_cache = {}
 
-        # node_id -> (lat, lon)
-        self.coords_curr = {}
-        self.coords_prev = {}
+        # 좌표는 SoA로 저장: (N,2) float64 배열 + node_id -> row index 맵
+        # (dict[id,(lat,lon)] 대비 tuple/float boxing 제거, 벡터 gather 가능)
+        self.coords_arr = np.empty((0, 2), dtype=np.float64)
+        self.node_index_curr = {}
+        self.node_index_prev = {}
+
+        # prev way geometry 계산 시 "prev에 없는 노드 좌표"를 curr로 보완하기 위한 index 맵
+        self.node_index_prev_fallback = {}
+
+        # way metric 메모이제이션: (side, obj_id, version) -> (length, area, centroid)
+        # 같은 way의 같은 버전 geometry를 레코드마다 다시 계산하지 않기 위함
+        self._way_metrics_cache = {}
 
-        # prev way geometry 계산 시 "prev에 없는 노드 좌표"를 curr로 보완하기 위한 cache
-        self.coords_prev_fallback = {}
+        # timestamp 문자열 -> unix seconds 메모이제이션
+        self._ts_cache = {}
 
         # changeset / user 통계 (Context 피처)
-        self.stats_cs_size = Counter()
-        self.stats_user_edit = Counter()
-        self.stats_user_div = defaultdict(set)
+        # Counter 대신 평범한 dict 증가: 레코드마다 도는 핫루프라
+        # Counter의 __missing__/__setitem__ 디스패치 비용도 아낀다
+        self.stats_cs_size = {}
+        self.stats_user_edit = {}
+
+        # user별 obj_type 다양성: set 대신 3비트 마스크 (메모리 ~200x 절약)
+        self.stats_user_div = {}
 
     # ----------------------------
     # Utility
     # ----------------------------
     def _parse_ts(self, ts_str):
-        """OSM timestamp string -> unix seconds. 없거나 파싱 실패 시 0."""
+        """OSM timestamp string -> unix seconds (UTC). 없거나 파싱 실패 시 0.
+
+        포맷이 "YYYY-MM-DDTHH:MM:SSZ"로 고정이라 strptime 대신 슬라이스 +
+        calendar.timegm으로 파싱한다 (strptime 대비 수십 배 빠름).
+        같은 changeset 안에서는 timestamp가 많이 겹치므로 결과를 캐싱.
+        """
         if not ts_str:
             return 0
-        try:
-            return int(datetime.strptime(ts_str, "%Y-%m-%dT%H:%M:%SZ").timestamp())
-        except:
-            return 0
 
-    def _haversine(self, lat1, lon1, lat2, lon2):
-        """두 위경도 사이 거리(m)."""
-        if lat1 is None or lat2 is None or lon1 is None or lon2 is None:
-            return 0.0
+        cached = self._ts_cache.get(ts_str)
+        if cached is not None:
+            return cached
 
-        R = 6371000.0
         try:
-            phi1, phi2 = math.radians(lat1), math.radians(lat2)
-            dphi = math.radians(lat2 - lat1)
-            dlambda = math.radians(lon2 - lon1)
+            ts = calendar.timegm((
+                int(ts_str[0:4]), int(ts_str[5:7]), int(ts_str[8:10]),
+                int(ts_str[11:13]), int(ts_str[14:16]), int(ts_str[17:19]),
+                0, 0, 0,
+            ))
+        except ValueError:
+            # 고정 포맷이 아니면 strptime으로 한 번 더 시도
+            try:
+                ts = calendar.timegm(
+                    datetime.strptime(ts_str, "%Y-%m-%dT%H:%M:%SZ").timetuple()
+                )
+            except ValueError:
+                ts = 0
 
-            a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-            c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-            return R * c
-        except:
-            return 0.0
+        self._ts_cache[ts_str] = ts
+        return ts
 
-    def _calculate_way_metrics(self, node_refs, coord_cache):
+    def _calculate_way_metrics(self, node_refs, index_map):
         """
         way의 node_refs로부터
         - length_m: polyline length
@@ -82,102 +270,126 @@ class LGBMFeatureExtractor:
 
         좌표 매칭이 부족하면 length/area/centroid 자체가 0으로 떨어질 수 있음.
         """
-        coords = []
         refs = node_refs or []
+        idxs = []
 
         for nid in refs:
-            try:
-                nid = int(nid)
-            except:
-                pass
-            if nid in coord_cache:
-                lat, lon = coord_cache[nid]
-                # lat/lon이 None이면 버림 (NaN/None 방지)
-                if lat is not None and lon is not None:
-                    coords.append((lat, lon))
-
-        if len(coords) < 2:
+            # 이미 int인 ref가 대부분이라 try 자체를 건너뛴다
+            if not isinstance(nid, int):
+                try:
+                    nid = int(nid)
+                except (ValueError, TypeError):
+                    pass
+            row = index_map.get(nid)
+            if row is not None:
+                idxs.append(row)
+
+        if len(idxs) < 2:
             return 0.0, 0.0, (0.0, 0.0)
 
-        # length
-        length_m = 0.0
-        for i in range(len(coords) - 1):
-            length_m += self._haversine(coords[i][0], coords[i][1], coords[i + 1][0], coords[i + 1][1])
+        # SoA 배열에서 정점 좌표를 벡터 gather (lat/lon 결측 행은 NaN으로 저장됨)
+        pts = self.coords_arr[np.asarray(idxs, dtype=np.int64)]
+        pts = pts[~np.isnan(pts).any(axis=1)]
 
-        # centroid
-        sum_lat = sum(c[0] for c in coords)
-        sum_lon = sum(c[1] for c in coords)
-        centroid = (sum_lat / len(coords), sum_lon / len(coords))
+        if len(pts) < 2:
+            return 0.0, 0.0, (0.0, 0.0)
 
-        # area: 폐곡선일 때만 계산 (open way의 area는 노이즈)
-        area_m2 = 0.0
         is_closed = (len(refs) >= 3 and str(refs[0]) == str(refs[-1]))
+        length_m, area_m2, cent_lat, cent_lon = _way_metrics_kernel(
+            np.ascontiguousarray(pts[:, 0]), np.ascontiguousarray(pts[:, 1]), is_closed
+        )
 
-        if is_closed and len(coords) >= 3:
-            xy = []
-            for lat, lon in coords:
-                y = lat * 111320
-                x = lon * (40075000 * math.cos(math.radians(lat)) / 360)
-                xy.append((x, y))
-
-            sum1 = sum(xy[i][0] * xy[(i + 1) % len(xy)][1] for i in range(len(xy)))
-            sum2 = sum(xy[i][1] * xy[(i + 1) % len(xy)][0] for i in range(len(xy)))
-            area_m2 = 0.5 * abs(sum1 - sum2)
+        return length_m, area_m2, (cent_lat, cent_lon)
 
-        return length_m, area_m2, centroid
+    def _way_metrics_cached(self, cache_key, node_refs, index_map):
+        """(side, obj_id, version) 키로 _calculate_way_metrics 결과를 메모이제이션."""
+        cached = self._way_metrics_cache.get(cache_key)
+        if cached is None:
+            cached = self._calculate_way_metrics(node_refs, index_map)
+            self._way_metrics_cache[cache_key] = cached
+        return cached
 
     # ----------------------------
     # Preprocess (scan & cache)
     # ----------------------------
     def preprocess(self):
         """
-        1) prev 파일(object_versions.jsonl) 읽어서 prev_cache/coords_prev 구축
-        2) curr 파일(objects.jsonl) 읽어서 coords_curr + changeset/user 통계 구축
-        3) coords_prev_fallback 구축 (prev 없는 노드는 curr로 보완)
+        1) prev 파일(object_versions.jsonl) 읽어서 prev_cache/prev 좌표 구축
+        2) curr 파일(objects.jsonl) 읽어서 curr 좌표 + changeset/user 통계 구축
+        3) prev fallback index 구축 (prev 없는 노드는 curr로 보완)
         """
         print("데이터 스캔 및 캐싱...")
 
-        # 1) Prev scan
+        # 좌표 배열은 라인 수 상한만큼 미리 할당하고 커서로 채운다
+        # (튜플 리스트에 쌓았다가 asarray로 복사하는 중간 단계 제거)
+        n_lines = 0
+        for path in (self.input_prev, self.input_curr):
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    n_lines += sum(1 for _ in f)
+
+        coords = np.full((n_lines, 2), np.nan, dtype=np.float64)
+        n_used = 0
+
+        def _register(index_map, obj_id, geom):
+            nonlocal n_used
+            lat = geom.get("lat")
+            lon = geom.get("lon")
+            index_map[obj_id] = n_used
+            if lat is not None:
+                coords[n_used, 0] = lat
+            if lon is not None:
+                coords[n_used, 1] = lon
+            n_used += 1
+
+        # 1) Prev scan (orjson은 bytes 입력이라 바이너리 모드로 읽는다)
         if os.path.exists(self.input_prev):
-            with open(self.input_prev, "r", encoding="utf-8") as f:
+            with open(self.input_prev, "rb") as f:
                 for line in f:
                     try:
-                        d = json.loads(line)
-                        self.prev_cache[(d.get("obj_type"), d.get("obj_id"), d.get("version"))] = d
+                        d = orjson.loads(line)
+                        self.prev_cache[(d["obj_type"], d["obj_id"], d["version"])] = d
 
-                        if d.get("obj_type") == "node" and "geom" in d and d["geom"]:
-                            self.coords_prev[d.get("obj_id")] = (d["geom"].get("lat"), d["geom"].get("lon"))
-                    except:
+                        if d["obj_type"] == "node" and d.get("geom"):
+                            _register(self.node_index_prev, d["obj_id"], d["geom"])
+                    except (orjson.JSONDecodeError, KeyError, TypeError):
                         continue
 
         # 2) Curr scan
         if os.path.exists(self.input_curr):
-            with open(self.input_curr, "r", encoding="utf-8") as f:
+            with open(self.input_curr, "rb") as f:
                 for line in f:
                     try:
-                        d = json.loads(line)
+                        d = orjson.loads(line)
+
+                        if d.get("obj_type") == "node" and d.get("geom"):
+                            _register(self.node_index_curr, d["obj_id"], d["geom"])
+
+                        cid = d.get("changeset_id")
+                        self.stats_cs_size[cid] = self.stats_cs_size.get(cid, 0) + 1
+                        uid = d.get("uid") or 0  # 익명 편집은 "uid": null
+                        self.stats_user_edit[uid] = self.stats_user_edit.get(uid, 0) + 1
+                        self.stats_user_div[uid] = (
+                            self.stats_user_div.get(uid, 0) | _TYPE_BIT.get(d.get("obj_type"), 0)
+                        )
+                    except (orjson.JSONDecodeError, AttributeError, TypeError):
+                        continue
 
-                        if d.get("obj_type") == "node" and "geom" in d and d["geom"]:
-                            self.coords_curr[d.get("obj_id")] = (d["geom"].get("lat"), d["geom"].get("lon"))
+        # 실제로 쓴 행까지만 잘라서 고정 (미사용 꼬리는 버린다)
+        self.coords_arr = coords[:n_used]
 
-                        self.stats_cs_size[d.get("changeset_id")] += 1
-                        uid = d.get("uid", 0)
-                        self.stats_user_edit[uid] += 1
-                        self.stats_user_div[uid].add(d.get("obj_type"))
-                    except:
-                        continue
+        # 3) prev_fallback index
+        # prev 우선, 없으면 curr로 폴백 — 복사본 dict를 만들지 않고 ChainMap으로 연결
+        self.node_index_prev_fallback = ChainMap(self.node_index_prev, self.node_index_curr)
 
-        # 3) prev_fallback cache
-        # 기본은 curr 좌표, prev 좌표가 있으면 prev로 덮어서 "이전 상태" 우선
-        self.coords_prev_fallback = dict(self.coords_curr)
-        self.coords_prev_fallback.update(self.coords_prev)
+        # numba 사용 시 JIT 컴파일 비용을 본 처리 전에 미리 지불
+        _way_metrics_kernel(np.zeros(2), np.zeros(2), False)
 
     # ----------------------------
     # Feature extraction per record
     # ----------------------------
     def extract_row(self, curr):
-        feat = {}
-
+        """한 레코드의 피처를 _FEATURE_DTYPES 순서의 튜플로 반환."""
         action = (curr.get("action") or "").lower()
         version = curr.get("version", 1)
 
@@ -189,23 +401,21 @@ class LGBMFeatureExtractor:
         # --------------------------------
         # 0) Identifiers
         # --------------------------------
-        feat["changeset_id"] = curr.get("changeset_id")
-        feat["obj_id"] = curr.get("obj_id")
+        changeset_id = curr.get("changeset_id") or 0
+        obj_id = curr.get("obj_id") or 0
 
         # --------------------------------
         # 1) Basic Meta
         # --------------------------------
         type_map = {"node": 0, "way": 1, "relation": 2}
-        feat["object_type"] = type_map.get(curr.get("obj_type"), -1)
-        feat["version_count"] = version
+        object_type = type_map.get(curr.get("obj_type"), -1)
 
-        feat["is_delete"] = 1 if action == "delete" else 0
-        feat["is_create"] = 1 if action == "create" else 0
-        feat["is_modify"] = 1 if action == "modify" else 0
+        is_delete = 1 if action == "delete" else 0
+        is_create = 1 if action == "create" else 0
+        is_modify = 1 if action == "modify" else 0
 
         curr_ts = self._parse_ts(curr.get("timestamp"))
-        feat["last_modified_time"] = curr_ts
-        feat["created_time"] = curr_ts if version == 1 else 0
+        created_time = curr_ts if version == 1 else 0
 
         # --------------------------------
         # 2) Tag-based (diff)
@@ -213,21 +423,33 @@ class LGBMFeatureExtractor:
         c_tags = curr.get("tags", {}) or {}
         p_tags = (prev.get("tags", {}) if prev else {}) or {}
 
-        c_keys, p_keys = set(c_tags.keys()), set(p_tags.keys())
-
-        feat["tag_count"] = len(c_tags)
-        feat["tag_add_count"] = len(c_keys - p_keys)
-        feat["tag_remove_count"] = len(p_keys - c_keys)
-        feat["tag_modify_count"] = sum(1 for k in (c_keys & p_keys) if c_tags.get(k) != p_tags.get(k))
-        feat["name_changed"] = 1 if c_tags.get("name") != p_tags.get("name") else 0
+        # geometry만 바뀐 레코드가 많으므로 태그가 같으면 diff를 통째로 스킵
+        # (dict __eq__는 C 레벨이고 길이 비교로 먼저 짧게 끝난다)
+        if c_tags == p_tags:
+            tag_add = tag_mod = tag_rem = 0
+            name_changed = 0
+        else:
+            # set() 생성 없이 dict를 한 번씩만 순회하며 add/modify/remove를 집계
+            tag_add = tag_mod = tag_rem = 0
+            for k, v in c_tags.items():
+                if k in p_tags:
+                    if p_tags[k] != v:
+                        tag_mod += 1
+                else:
+                    tag_add += 1
+            for k in p_tags:
+                if k not in c_tags:
+                    tag_rem += 1
+            name_changed = 1 if c_tags.get("name") != p_tags.get("name") else 0
+
+        tag_count = len(c_tags)
 
         # --------------------------------
         # 3) Geometry-based (diff)
         # --------------------------------
-        feat["length_change_ratio"] = 0.0
-        feat["area_change_ratio"] = 0.0
-        feat["node_count_change"] = 0
-        feat["centroid_shift"] = 0.0
+        length_change_ratio = 0.0
+        area_change_ratio = 0.0
+        centroid_shift = 0.0
 
         obj_type = curr.get("obj_type")
 
@@ -241,48 +463,59 @@ class LGBMFeatureExtractor:
             if not p_refs:
                 p_refs = (prev.get("refs", {}) or {}).get("members", [])
 
-        feat["node_count_change"] = len(c_refs) - len(p_refs)
+        node_count_change = len(c_refs) - len(p_refs)
 
         if obj_type == "node":
             if prev and "geom" in curr and "geom" in prev and curr["geom"] and prev["geom"]:
-                feat["centroid_shift"] = self._haversine(
+                centroid_shift = _haversine(
                     curr["geom"].get("lat"), curr["geom"].get("lon"),
                     prev["geom"].get("lat"), prev["geom"].get("lon"),
                 )
 
         elif obj_type == "way":
-            c_len, c_area, c_cent = self._calculate_way_metrics(c_refs, self.coords_curr)
+            c_len, c_area, c_cent = self._way_metrics_cached(
+                ("curr", obj_id, version), c_refs, self.node_index_curr
+            )
 
             if prev:
-                p_len, p_area, p_cent = self._calculate_way_metrics(p_refs, self.coords_prev_fallback)
+                p_len, p_area, p_cent = self._way_metrics_cached(
+                    ("prev", obj_id, version - 1), p_refs, self.node_index_prev_fallback
+                )
 
                 eps = 1e-6
-                feat["length_change_ratio"] = (c_len - p_len) / max(p_len, eps)
-                feat["area_change_ratio"] = (c_area - p_area) / max(p_area, eps)
+                length_change_ratio = (c_len - p_len) / max(p_len, eps)
+                area_change_ratio = (c_area - p_area) / max(p_area, eps)
 
-                if p_len > 0:
-                    feat["centroid_shift"] = self._haversine(c_cent[0], c_cent[1], p_cent[0], p_cent[1])
+                # 양쪽 geometry가 모두 풀렸을 때만 의미가 있다 — delete way처럼
+                # refs가 없는 쪽이 있으면 (0,0) 센트로이드와의 거리가 나와버린다
+                if p_len > 0 and c_len > 0:
+                    centroid_shift = _haversine(c_cent[0], c_cent[1], p_cent[0], p_cent[1])
 
         # --------------------------------
         # 4) Changeset Derived (Context)
         # --------------------------------
-        cid = curr.get("changeset_id")
-        uid = curr.get("uid", 0)
-
-        feat["changeset_size"] = self.stats_cs_size.get(cid, 0)
-        feat["user_edit_count"] = self.stats_user_edit.get(uid, 0)
-        feat["user_object_diversity"] = len(self.stats_user_div.get(uid, set()))
+        # changeset/user 통계 피처는 run()에서 컬럼 단위로 일괄 계산
+        # (여기서는 조인 키인 uid만 실어 보낸다)
+        uid = curr.get("uid") or 0  # 익명 편집("uid": null)은 0으로 귀속
 
         # prev에 timestamp 추가
         prev_ts = self._parse_ts(prev.get("timestamp")) if prev else 0
-        feat["time_gap_prev"] = (curr_ts - prev_ts) if prev_ts > 0 else 0
-
-        return feat
+        time_gap_prev = (curr_ts - prev_ts) if prev_ts > 0 else 0
+
+        return (
+            changeset_id, obj_id,
+            object_type, version,
+            is_delete, is_create, is_modify,
+            curr_ts, created_time,
+            tag_count, tag_add, tag_rem, tag_mod, name_changed,
+            length_change_ratio, area_change_ratio, node_count_change, centroid_shift,
+            uid, time_gap_prev,
+        )
 
     # ----------------------------
     # Run
     # ----------------------------
-    def run(self):
+    def run(self, workers: int = 1):
         self.preprocess()
         results = []
         print("Feature 추출 중...")
@@ -291,15 +524,65 @@ class LGBMFeatureExtractor:
             print(f"입력 파일 없음: {self.input_curr}")
             return
 
-        with open(self.input_curr, "r", encoding="utf-8") as f:
-            for line in tqdm(f):
+        # 1) curr 레코드를 먼저 전부 읽으면서 (type,id,version) 인덱스를 만든다.
+        #    같은 파일 안에 v-1 레코드가 있으면 prev API 데이터 없이도 diff가 가능하므로
+        #    curr 레코드 자체를 prev 후보로 등록 (이미 있는 진짜 prev가 우선).
+        records = []
+        with open(self.input_curr, "rb") as f:
+            for line in f:
+                try:
+                    curr = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+                # 유효한 JSON이어도 dict가 아닌 라인은 건너뛴다 (예: 숫자/배열)
+                if not isinstance(curr, dict):
+                    continue
+                records.append(curr)
+                key = (curr.get("obj_type"), curr.get("obj_id"), curr.get("version"))
+                self.prev_cache.setdefault(key, curr)
+
+        # 2) 인덱싱이 끝난 뒤 feature 추출
+        #    extract_row는 읽기 전용 캐시만 쓰는 순수 함수라 fork 기반 Pool로
+        #    병렬화 가능 (chunk 단위 imap이라 행 순서는 유지됨)
+        use_pool = (
+            workers and workers > 1
+            and len(records) > 1
+            and "fork" in mp.get_all_start_methods()
+        )
+
+        if use_pool:
+            global _POOL_EXTRACTOR
+            _POOL_EXTRACTOR = self
+            try:
+                chunk_size = max(1000, len(records) // (workers * 4))
+                chunks = [records[i:i + chunk_size] for i in range(0, len(records), chunk_size)]
+
+                ctx = mp.get_context("fork")
+                with ctx.Pool(processes=workers) as pool:
+                    for part in tqdm(pool.imap(_extract_chunk, chunks), total=len(chunks)):
+                        results.extend(part)
+            finally:
+                _POOL_EXTRACTOR = None
+        else:
+            for curr in tqdm(records):
                 try:
-                    curr = json.loads(line)
                     results.append(self.extract_row(curr))
-                except:
+                except Exception:
                     continue
 
-        df = pd.DataFrame(results)
+        # dict 리스트 대신 컬럼 단위 typed ndarray로 조립
+        # (pandas의 행 단위 dtype 추론과 N×C 파이썬 객체 생성을 건너뛴다)
+        arrs = {}
+        if results:
+            for (name, dtype), col in zip(_FEATURE_DTYPES, zip(*results)):
+                arrs[name] = np.asarray(col, dtype=dtype)
+        df = pd.DataFrame(arrs)
+
+        # changeset/user 파생 피처: 행 단위 dict 조회 대신 컬럼 map으로 한 번에 계산
+        user_div_counts = {u: mask.bit_count() for u, mask in self.stats_user_div.items()}
+        df["changeset_size"] = df["changeset_id"].map(self.stats_cs_size).fillna(0).astype(np.int32)
+        df["user_edit_count"] = df["uid"].map(self.stats_user_edit).fillna(0).astype(np.int32)
+        df["user_object_diversity"] = df["uid"].map(user_div_counts).fillna(0).astype(np.int32)
 
         cols = [
             # 0) identifiers
@@ -325,19 +608,20 @@ class LGBMFeatureExtractor:
             if c not in df.columns:
                 df[c] = 0
 
-        # (2) 값이 None/문자열 등으로 섞여 NaN이 생기면 -> 숫자로 강제 변환 (실패는 NaN)
-        #     그 후 NaN을 0으로 치환 (결측치 0처리 보장)
-        df[cols] = df[cols].apply(pd.to_numeric, errors="coerce")
-        df[cols] = df[cols].fillna(0)
-
-        # (3) 혹시 모를 inf/-inf도 0 처리 (ratio 계산 보호)
-        df[cols] = df[cols].replace([float("inf"), float("-inf")], 0)
+        # (2) 숫자 강제 변환(실패는 NaN) 후, NaN/inf 0 처리는 프레임 전체를
+        #     세 번 다시 쓰는 대신 ndarray 위에서 단일 패스로 융합
+        arr = df[cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64, na_value=0.0)
+        np.nan_to_num(arr, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
 
-        df[cols].to_csv(self.output_file, index=False)
+        out = pd.DataFrame(arr, columns=cols)
+        if pa is not None:
+            pacsv.write_csv(pa.Table.from_pandas(out, preserve_index=False), self.output_file)
+        else:
+            out.to_csv(self.output_file, index=False)
         print(f"저장: {self.output_file}")
-        print(f"   Shape: {df.shape}")
+        print(f"   Shape: {out.shape}")
 
 
 if __name__ == "__main__":
     extractor = LGBMFeatureExtractor()
-    extractor.run()
+    extractor.run(workers=os.cpu_count() or 1)
@@ -1,60 +1,314 @@
 import requests
-import xml.etree.ElementTree as ET
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# lxml(libxml2 기반)이 있으면 사용: 파싱/탐색이 C 레벨이라 2~5배 빠르고 API 호환.
+# 없으면 stdlib ElementTree로 동작한다.
+try:
+    from lxml import etree as ET
+
+    _XMLParseError = ET.XMLSyntaxError
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+    _XMLParseError = ET.ParseError
+
+import orjson
 import csv
+import gzip
+import os
+import sqlite3
+import sys
+
+# pyarrow가 있으면 Parquet 내보내기 / 고속 CSV 파싱을 지원한다 (없으면 stdlib만)
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Set, Tuple
 from pathlib import Path
 import logging
 
+from object_version_extractor import TokenBucket
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
+# 태그 키 인터닝: highway/building/name 같은 키가 수십만 번 반복되므로
+# 같은 문자열 객체를 공유해 메모리를 줄이고 dict 조회를 빠르게 한다
+_INTERN = sys.intern
+
+# API URL 템플릿: 행마다 f-string을 다시 포맷하는 대신 bound format을 재사용
+_CHANGESET_URL = "https://api.openstreetmap.org/api/0.6/changeset/{}/download".format
+_OBJECT_URL = "https://api.openstreetmap.org/api/0.6/{}/{}/{}".format
+
+# changeset id 컬럼으로 인정하는 헤더 이름 (정규화 후 비교)
+_HEADER_CANDIDATES = frozenset({"changesetid", "changeset", "id"})
+# 헤더 정규화: 공백/하이픈/언더스코어 제거용 변환 테이블 (str.replace 반복보다 빠름)
+_HEADER_TBL = str.maketrans("", "", " -_")
+
+
+def load_changeset_ids(path: Path) -> List[int]:
+    """CSV/TSV 파일에서 changeset id 목록을 로드한다 (중복 제거, 순서 유지)."""
+    if not path.exists():
+        raise FileNotFoundError(f"Dataset file not found: {path}")
+
+    # 확장자로 delimiter 결정 (Sniffer는 단일 컬럼 파일에서 순수 오버헤드)
+    delimiter = "\t" if path.suffix.lower() in [".tsv", ".tab"] else ","
+
+    # pyarrow가 있으면 멀티스레드 C 파서로 읽는다 (대용량 id 목록에서 수십 배 빠름)
+    if pa is not None:
+        try:
+            return _load_changeset_ids_arrow(path, delimiter)
+        except (pa.ArrowInvalid, KeyError, ValueError):
+            # 헤더/형식이 예상과 다르면 관대한 순수 파이썬 경로로 폴백
+            pass
+
+    return _load_changeset_ids_python(path, delimiter)
+
+
+def _load_changeset_ids_arrow(path: Path, delimiter: str) -> List[int]:
+    tbl = pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True),
+        parse_options=pacsv.ParseOptions(delimiter=delimiter),
+    )
+
+    column = None
+    for name in tbl.column_names:
+        if name.lower().translate(_HEADER_TBL) in _HEADER_CANDIDATES:
+            column = name
+            break
+    if column is None:
+        raise ValueError(f"'changeset' column not found in {path}")
+
+    col = tbl.column(column).drop_null().cast(pa.int64())
+    # 중복 제거(순서 유지) — pyarrow unique()는 순서를 보장하지 않음
+    return list(dict.fromkeys(col.to_pylist()))
+
+
+def _load_changeset_ids_python(path: Path, delimiter: str) -> List[int]:
+    ids: List[int] = []
+
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+
+        # 헤더 변형("changeset_id", "Changeset ID" 등)을 정규화해서 매칭
+        column = None
+        for name in reader.fieldnames or []:
+            if name and name.lower().translate(_HEADER_TBL) in _HEADER_CANDIDATES:
+                column = name
+                break
+        if column is None:
+            raise ValueError(f"'changeset' column not found in {path}")
+
+        for row in reader:
+            raw = (row.get(column) or "").strip()
+            if not raw:
+                continue
+            try:
+                ids.append(int(raw))
+            except ValueError:
+                continue
+
+    # 중복 제거(순서 유지)
+    return list(dict.fromkeys(ids))
+
+
+class _ObjBuilder:
+    """osmChange 스트림을 객체 dict로 바로 변환하는 파서 타겟.
+
+    iterparse와 달리 Element 트리를 아예 만들지 않고 start/end 콜백에서
+    dict를 직접 조립한다 (lxml/stdlib XMLParser 양쪽과 호환).
+    출력 순서는 기존 findall 순회와 동일: create 전체 → modify 전체 → delete 전체
+    (문서에 블록이 섞여 있어도), 각 블록 안에서는 node → way → relation.
+
+    순수 파이썬 핫패스라 인스턴스 dict를 없애고(__slots__) 속성 접근을
+    오프셋 조회로 바꿔둔다. 별도 빌드 단계 없이 CPython/PyPy 어디서든 동작.
+    """
+
+    __slots__ = (
+        "changeset_id",
+        "_by_action",
+        "_action",
+        "_obj",
+        "_tags",
+        "_node_refs",
+        "_members",
+        "_buckets",
+    )
+
+    def __init__(self, changeset_id: int):
+        self.changeset_id = changeset_id
+        # action 종류별로 모아뒀다가 close()에서 create → modify → delete로 합친다
+        self._by_action: Dict[str, List[Dict]] = {"create": [], "modify": [], "delete": []}
+        self._action: Optional[str] = None
+        self._obj: Optional[Dict] = None
+        self._tags: Optional[Dict[str, str]] = None
+        self._node_refs: Optional[List[str]] = None
+        self._members: Optional[List[Dict]] = None
+        self._buckets: Dict[str, List[Dict]] = {"node": [], "way": [], "relation": []}
+
+    def start(self, tag, attrib):
+        if tag == "tag":
+            if self._tags is not None:
+                self._tags[_INTERN(attrib["k"])] = attrib["v"]
+        elif tag == "nd":
+            if self._node_refs is not None:
+                self._node_refs.append(attrib["ref"])
+        elif tag == "member":
+            if self._members is not None:
+                self._members.append(
+                    {
+                        "type": attrib.get("type"),
+                        "ref": attrib.get("ref"),
+                        "role": attrib.get("role", ""),
+                    }
+                )
+        elif tag in ("node", "way", "relation"):
+            if self._action is None:
+                return
+            uid = attrib.get("uid")
+            obj = {
+                "changeset_id": self.changeset_id,
+                "action": self._action,
+                "obj_type": tag,
+                "obj_id": int(attrib["id"]),
+                "version": int(attrib["version"]),
+                "timestamp": attrib.get("timestamp"),
+                "visible": attrib.get("visible", "true") == "true",
+                "user": attrib.get("user"),
+                "uid": int(uid) if uid else None,
+            }
+            if tag == "node":
+                lat = attrib.get("lat")
+                lon = attrib.get("lon")
+                if lat and lon:
+                    obj["geom"] = {"lat": float(lat), "lon": float(lon)}
+            elif tag == "way":
+                self._node_refs = []
+            else:
+                self._members = []
+            self._obj = obj
+            self._tags = {}
+        elif tag in ("create", "modify", "delete"):
+            self._action = tag
+
+    def end(self, tag):
+        if tag in ("node", "way", "relation"):
+            obj = self._obj
+            if obj is None:
+                return
+            if self._node_refs:
+                obj["refs"] = {"node_refs": self._node_refs}
+            elif self._members:
+                obj["refs"] = {"members": self._members}
+            if self._tags:
+                obj["tags"] = self._tags
+            self._buckets[tag].append(obj)
+            self._obj = None
+            self._tags = None
+            self._node_refs = None
+            self._members = None
+        elif tag in ("create", "modify", "delete"):
+            buckets = self._buckets
+            extend = self._by_action[tag].extend
+            for t in ("node", "way", "relation"):
+                extend(buckets[t])
+                buckets[t].clear()
+            self._action = None
+
+    def close(self) -> List[Dict]:
+        by_action = self._by_action
+        return by_action["create"] + by_action["modify"] + by_action["delete"]
+
 
 class ChangesetObjectExtractor:
-    def __init__(self, output_dir: str = "./output"):
+    # fetch queue CSV 컬럼 순서
+    _QUEUE_FIELDS = [
+        "changeset_id",
+        "action",
+        "obj_type",
+        "obj_id",
+        "cur_version",
+        "prev_version",
+        "reason",
+        "url",
+    ]
+
+    def __init__(self, output_dir: str = "./output", compress: bool = False):
         # 출력 디렉토리 설정 및 생성
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
 
         # 출력 파일 경로 설정
-        self.objects_file = self.output_dir / "objects.jsonl"
+        # compress=True면 objects를 gzip 스트림으로 쌓는다 (필드명 반복이 많아 5~10배 절약).
+        # 다운스트림 추출기들은 평문 JSONL을 읽으므로 기본값은 비압축
+        self.compress = compress
+        self.objects_file = self.output_dir / ("objects.jsonl.gz" if compress else "objects.jsonl")
         self.queue_file = self.output_dir / "fetch_prev_queue.csv"
+        self.parquet_file = self.output_dir / "objects.parquet"
 
         # 누적 실행을 위한 처리 완료 changeset 기록 파일
         self.processed_file = self.output_dir / "processed_changesets.txt"
 
-    # 파일에서 changeset id 목록 로드
-    def load_changeset_ids(self, path: Path) -> List[int]:
-        # 파일 존재 확인
-        if not path.exists():
-            raise FileNotFoundError(f"Dataset file not found: {path}")
-
-        # 확장자로 delimiter 결정
-        delimiter = "\t" if path.suffix.lower() in [".tsv", ".tab"] else ","
+        # 다운로드 동시성: 받기는 스레드 풀에서, 파싱/저장은 메인 스레드에서
+        # (object_version_extractor와 같은 구성. futures는 배치 단위로 제출)
+        self.max_workers = 4
+        self.batch_size = 64
+
+        # 전체 요청 속도는 토큰 버킷으로 제한 — 워커들이 서로 충돌 없이 스스로 페이스 조절
+        # (object_version_extractor와 같은 기본값 2 req/s)
+        self.rate_limiter = TokenBucket(2.0)
+
+        # keep-alive 세션: changeset마다 TCP+TLS 핸드셰이크를 새로 하지 않는다.
+        # 풀 크기는 워커 수에 맞추고, 일시적 오류(429/5xx)는 지수 백오프로 재시도.
+        # 서버가 Retry-After를 보내면 백오프 대신 그 시간을 따른다
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
-        ids: List[int] = []
+        # process_changesets 동안 열어두는 출력 파일 핸들
+        # (changeset마다 open/close 하지 않기 위함 — object_version_extractor와 동일)
+        self._objects_fh = None
+        self._processed_fh = None
 
-        # CSV 파일을 DictReader로 읽어서 'changeset' 컬럼에서 id 추출
-        with path.open("r", encoding="utf-8-sig", newline="") as f:
-            reader = csv.DictReader(f, delimiter=delimiter)
+        # fetch queue는 sqlite 사이드카에 쌓는다: UNIQUE 인덱스가 중복 제거를 대신하고,
+        # 누적 실행에서도 새 항목 INSERT만 들어간다 (CSV는 내보내기 포맷으로 유지)
+        self.queue_db = self.output_dir / "fetch_prev_queue.db"
+        self._queue_conn: Optional[sqlite3.Connection] = None
 
-            if not reader.fieldnames or "changeset" not in reader.fieldnames:
-                raise ValueError(f"'changeset' column not found in {path}")
+    # 파일에서 changeset id 목록 로드 (모듈 함수에 위임)
+    def load_changeset_ids(self, path: Path) -> List[int]:
+        return load_changeset_ids(path)
 
-            for row in reader:
-                raw = (row.get("changeset") or "").strip()
-                if not raw:
-                    continue
-                try:
-                    ids.append(int(raw))
-                except ValueError:
-                    continue
+    # 초당 요청 수 제한 변경 (object_version_extractor와 동일한 API)
+    def set_rate_limit(self, requests_per_second: float):
+        self.rate_limiter = TokenBucket(requests_per_second)
 
-        # 중복 제거(순서 유지)
-        return list(dict.fromkeys(ids))
+    # objects 파일 열기 — 압축 여부를 한 곳에서 처리
+    def _open_objects(self, mode: str):
+        if self.compress:
+            if "r" in mode:
+                return gzip.open(self.objects_file, mode)
+            # level 1: 순차 append에서 CPU 오버헤드를 거의 안 들이고 대부분의 압축률 확보
+            return gzip.open(self.objects_file, mode, compresslevel=1)
+        return self.objects_file.open(mode)
 
     # 이미 처리된 changeset 목록 로드
     def _load_processed_changesets(self) -> Set[int]:
@@ -75,253 +329,345 @@ class ChangesetObjectExtractor:
 
     # 처리 완료 changeset 기록(append)
     def _mark_processed(self, changeset_id: int) -> None:
-        with self.processed_file.open("a", encoding="utf-8") as f:
-            f.write(f"{changeset_id}\n")
+        line = f"{changeset_id}\n"
+
+        # process_changesets가 열어둔 핸들에 버퍼링해서 쓰고,
+        # 단독 호출 시에만 예전처럼 append 모드로 연다
+        if self._processed_fh is not None:
+            self._processed_fh.write(line)
+        else:
+            with self.processed_file.open("a", encoding="utf-8") as f:
+                f.write(line)
 
     # changeset 다운로드
-    def download_changeset(self, changeset_id: int) -> Optional[str]:
-        url = f"https://api.openstreetmap.org/api/0.6/changeset/{changeset_id}/download"
+    def download_changeset(self, changeset_id: int) -> Optional[bytes]:
+        url = _CHANGESET_URL(changeset_id)
         try:
             logger.info(f"Downloading changeset {changeset_id}...")
-            response = requests.get(url, timeout=30)
+            self.rate_limiter.acquire()
+            response = self.session.get(url, timeout=30)
             response.raise_for_status()
-            return response.text
+            # 파서에 bytes를 그대로 넘기므로 .text 디코딩을 거치지 않는다
+            return response.content
         except requests.RequestException as e:
             logger.error(f"Failed to download changeset {changeset_id}: {e}")
             return None
 
-    # XML에서 node 요소 파싱
-    def parse_node(self, node_elem: ET.Element, action: str, changeset_id: int) -> Dict:
-        obj = {
-            "changeset_id": changeset_id,
-            "action": action,
-            "obj_type": "node",
-            "obj_id": int(node_elem.get("id")),
-            "version": int(node_elem.get("version")),
-            "timestamp": node_elem.get("timestamp"),
-            "visible": node_elem.get("visible", "true") == "true",
-            "user": node_elem.get("user"),
-            "uid": int(node_elem.get("uid")) if node_elem.get("uid") else None,
-        }
-
-        if node_elem.get("lat") and node_elem.get("lon"):
-            obj["geom"] = {
-                "lat": float(node_elem.get("lat")),
-                "lon": float(node_elem.get("lon")),
-            }
-
-        tags = {}
-        for tag in node_elem.findall("tag"):
-            tags[tag.get("k")] = tag.get("v")
-        if tags:
-            obj["tags"] = tags
-
-        return obj
-
-    # XML에서 way 요소 파싱
-    def parse_way(self, way_elem: ET.Element, action: str, changeset_id: int) -> Dict:
-        obj = {
-            "changeset_id": changeset_id,
-            "action": action,
-            "obj_type": "way",
-            "obj_id": int(way_elem.get("id")),
-            "version": int(way_elem.get("version")),
-            "timestamp": way_elem.get("timestamp"),
-            "visible": way_elem.get("visible", "true") == "true",
-            "user": way_elem.get("user"),
-            "uid": int(way_elem.get("uid")) if way_elem.get("uid") else None,
-        }
-
-        node_refs = [nd.get("ref") for nd in way_elem.findall("nd")]
-        if node_refs:
-            obj["refs"] = {"node_refs": node_refs}
-
-        tags = {}
-        for tag in way_elem.findall("tag"):
-            tags[tag.get("k")] = tag.get("v")
-        if tags:
-            obj["tags"] = tags
-
-        return obj
-
-    # XML에서 relation 요소 파싱
-    def parse_relation(self, rel_elem: ET.Element, action: str, changeset_id: int) -> Dict:
-        obj = {
-            "changeset_id": changeset_id,
-            "action": action,
-            "obj_type": "relation",
-            "obj_id": int(rel_elem.get("id")),
-            "version": int(rel_elem.get("version")),
-            "timestamp": rel_elem.get("timestamp"),
-            "visible": rel_elem.get("visible", "true") == "true",
-            "user": rel_elem.get("user"),
-            "uid": int(rel_elem.get("uid")) if rel_elem.get("uid") else None,
-        }
-
-        members = []
-        for member in rel_elem.findall("member"):
-            members.append(
-                {
-                    "type": member.get("type"),
-                    "ref": member.get("ref"),
-                    "role": member.get("role", ""),
-                }
-            )
-        if members:
-            obj["refs"] = {"members": members}
-
-        tags = {}
-        for tag in rel_elem.findall("tag"):
-            tags[tag.get("k")] = tag.get("v")
-        if tags:
-            obj["tags"] = tags
-
-        return obj
-
     # changeset에서 객체 추출
-    def extract_objects(self, changeset_id: int) -> Optional[List[Dict]]:
-        xml_data = self.download_changeset(changeset_id)
+    def extract_objects(self, changeset_id: int, xml_data: Optional[bytes] = None) -> Optional[List[Dict]]:
+        # xml_data가 주어지면(스레드 풀에서 미리 받아온 응답) 다운로드를 건너뛴다
+        if xml_data is None:
+            xml_data = self.download_changeset(changeset_id)
         if not xml_data:
             return None  # 다운로드 실패
 
+        # Element 트리를 만들지 않고 파서 콜백에서 바로 dict를 조립한다.
+        # (iterparse + clear()보다도 할당이 적고, 피크 메모리는 객체 dict 크기뿐)
+        builder = _ObjBuilder(changeset_id)
+        parser = ET.XMLParser(target=builder)
+
         try:
-            root = ET.fromstring(xml_data)
-        except ET.ParseError as e:
+            parser.feed(xml_data)
+            objects = parser.close()
+        except _XMLParseError as e:
             logger.error(f"Failed to parse XML for changeset {changeset_id}: {e}")
             return None  # 파싱 실패
 
-        objects: List[Dict] = []
-
-        for action in ["create", "modify", "delete"]:
-            for action_elem in root.findall(action):
-                for node in action_elem.findall("node"):
-                    objects.append(self.parse_node(node, action, changeset_id))
-
-                for way in action_elem.findall("way"):
-                    objects.append(self.parse_way(way, action, changeset_id))
+        logger.info(f"Extracted {len(objects)} objects from changeset {changeset_id}")
+        return objects
+
+    # 추출된 객체를 JSONL 파일에 저장 (buf가 있으면 워커가 직렬화해둔 것을 그대로 사용)
+    def save_objects(self, objects: List[Dict], buf: Optional[bytes] = None):
+        # 객체당 json.dumps + write() 한 번씩 대신, orjson으로 직렬화한 라인들을
+        # 하나의 버퍼로 묶어 단일 write로 내보낸다 (개행은 orjson이 C 레벨에서 붙인다)
+        if buf is None:
+            buf = b"".join(orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE) for obj in objects)
+        if self._objects_fh is not None:
+            self._objects_fh.write(buf)
+        else:
+            with self._open_objects("ab") as f:
+                f.write(buf)
+        logger.info(f"Saved {len(objects)} objects to {self.objects_file}")
 
-                for relation in action_elem.findall("relation"):
-                    objects.append(self.parse_relation(relation, action, changeset_id))
+    # 큐 sqlite 사이드카 열기 (+ 예전 실행이 CSV만 남겼으면 1회 이관)
+    def _open_queue_db(self) -> sqlite3.Connection:
+        if self._queue_conn is not None:
+            return self._queue_conn
+
+        conn = sqlite3.connect(self.queue_db)
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS fetch_queue (
+                changeset_id INTEGER,
+                action TEXT,
+                obj_type TEXT,
+                obj_id INTEGER,
+                cur_version INTEGER,
+                prev_version INTEGER,
+                reason TEXT,
+                url TEXT,
+                UNIQUE (obj_type, obj_id, prev_version)
+            )"""
+        )
 
-        logger.info(f"Extracted {len(objects)} objects from changeset {changeset_id}")
-        return objects 
+        # db가 비어 있는데 기존 CSV가 있으면 그 내용을 받아들인다
+        if conn.execute("SELECT COUNT(*) FROM fetch_queue").fetchone()[0] == 0 and self.queue_file.exists():
+            with self.queue_file.open("r", encoding="utf-8", newline="") as f:
+                reader = csv.reader(f)
+                next(reader, None)  # 헤더
+                rows = [tuple(row) for row in reader if len(row) == len(self._QUEUE_FIELDS)]
+            if rows:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO fetch_queue VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                conn.commit()
+
+        self._queue_conn = conn
+        return conn
+
+    # 추출 직후 이전 버전이 필요한 객체를 큐 db에 바로 적재
+    def _enqueue_prev_fetches(self, objects: List[Dict]) -> None:
+        rows = []
+        for obj in objects:
+            if obj.get("action") == "modify" and obj.get("version", 0) > 1:
+                prev_version = obj["version"] - 1
+
+                # obj_id/version은 파서가 이미 int로 캐스팅해둠 — 재캐스팅 불필요
+                obj_type = obj["obj_type"]
+                obj_id = obj["obj_id"]
+                rows.append(
+                    (
+                        obj["changeset_id"],
+                        obj["action"],
+                        obj_type,
+                        obj_id,
+                        obj["version"],
+                        prev_version,
+                        "need_before_state",
+                        _OBJECT_URL(obj_type, obj_id, prev_version),
+                    )
+                )
 
-    # 추출된 객체를 JSONL 파일에 저장
-    def save_objects(self, objects: List[Dict]):
-        with self.objects_file.open("a", encoding="utf-8") as f:
-            for obj in objects:
-                f.write(json.dumps(obj, ensure_ascii=False) + "\n")
-        logger.info(f"Saved {len(objects)} objects to {self.objects_file}")
+        if rows:
+            # 중복은 UNIQUE (obj_type, obj_id, prev_version) 인덱스가 걸러낸다.
+            # 커밋은 호출자(체크포인트/종료)가 모아서 한다
+            self._open_queue_db().executemany(
+                "INSERT OR IGNORE INTO fetch_queue VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
 
-    # 이전 버전이 필요한 객체를 fetch queue에 추가
-    def generate_fetch_queue(self):
+    # 단독 호출용 폴백: objects.jsonl 전체를 스캔해서 큐 db를 다시 만든다
+    def _rebuild_queue_from_objects(self) -> None:
         if not self.objects_file.exists():
             logger.warning(f"{self.objects_file} not found")
             return
 
-        queue_items: List[Dict] = []
-        seen: Set[Tuple[str, int, int]] = set()
-
-        with self.objects_file.open("r", encoding="utf-8") as f:
+        # orjson은 bytes 입력이라 바이너리 모드로 읽는다
+        with self._open_objects("rb") as f:
             for line in f:
                 line = line.strip()
                 if not line:
                     continue
 
                 try:
-                    obj = json.loads(line)
-                except json.JSONDecodeError:
+                    obj = orjson.loads(line)
+                except orjson.JSONDecodeError:
                     continue
 
-                if obj.get("action") == "modify" and obj.get("version", 0) > 1:
-                    prev_version = obj["version"] - 1
-
-                    key = (obj.get("obj_type"), int(obj.get("obj_id")), int(prev_version))
-                    if key in seen:
-                        continue
-                    seen.add(key)
-
-                    url = f"https://api.openstreetmap.org/api/0.6/{obj['obj_type']}/{obj['obj_id']}/{prev_version}"
-
-                    queue_items.append(
-                        {
-                            "changeset_id": obj["changeset_id"],
-                            "action": obj["action"],
-                            "obj_type": obj["obj_type"],
-                            "obj_id": obj["obj_id"],
-                            "cur_version": obj["version"],
-                            "prev_version": prev_version,
-                            "reason": "need_before_state",
-                            "url": url,
-                        }
-                    )
+                self._enqueue_prev_fetches((obj,))
+
+        self._open_queue_db().commit()
 
-        if queue_items:
+    # 이전 버전이 필요한 객체 큐를 CSV로 내보내기 (db가 원본, CSV는 다운스트림용)
+    def generate_fetch_queue(self):
+        conn = self._open_queue_db()
+        conn.commit()
+
+        count = conn.execute("SELECT COUNT(*) FROM fetch_queue").fetchone()[0]
+        if count == 0:
+            # 단독 호출이고 db가 비어 있으면 objects.jsonl 전체 스캔으로 복구
+            self._rebuild_queue_from_objects()
+            count = conn.execute("SELECT COUNT(*) FROM fetch_queue").fetchone()[0]
+
+        if count:
+            # SELECT는 rowid(삽입) 순서 — 기존 CSV의 행 순서와 동일하다
             with self.queue_file.open("w", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(
-                    f,
-                    fieldnames=[
-                        "changeset_id",
-                        "action",
-                        "obj_type",
-                        "obj_id",
-                        "cur_version",
-                        "prev_version",
-                        "reason",
-                        "url",
-                    ],
-                )
-                writer.writeheader()
-                writer.writerows(queue_items)
-            logger.info(f"Generated fetch queue with {len(queue_items)} items at {self.queue_file}")
+                writer = csv.writer(f)
+                writer.writerow(self._QUEUE_FIELDS)
+                writer.writerows(conn.execute("SELECT * FROM fetch_queue"))
+            logger.info(f"Generated fetch queue with {count} items at {self.queue_file}")
         else:
             logger.info("No objects require previous version fetch")
 
+    # objects.jsonl을 컬럼 지향 Parquet으로 내보내기 (opt-in)
+    # 다운스트림 추출기들이 JSONL을 읽으므로 JSONL이 기본 포맷이고 Parquet은 분석용 사이드카.
+    # 가변 스키마인 tags/refs는 JSON 문자열 컬럼으로 평탄화한다.
+    def export_parquet(self, path: Optional[Path] = None) -> Optional[Path]:
+        if pa is None:
+            logger.warning("pyarrow not installed; skipping Parquet export")
+            return None
+        if not self.objects_file.exists():
+            logger.warning(f"{self.objects_file} not found")
+            return None
+
+        out_path = Path(path) if path else self.parquet_file
+
+        # 컬럼 타입을 명시해서 Arrow의 타입 추론을 건너뛰고
+        # 변환이 전 컬럼 단위 C 루프 한 번으로 끝나게 한다
+        schema = pa.schema(
+            [
+                ("changeset_id", pa.int64()),
+                ("action", pa.string()),
+                ("obj_type", pa.string()),
+                ("obj_id", pa.int64()),
+                ("version", pa.int64()),
+                ("timestamp", pa.string()),
+                ("visible", pa.bool_()),
+                ("user", pa.string()),
+                ("uid", pa.int64()),
+                ("lat", pa.float64()),
+                ("lon", pa.float64()),
+                ("tags", pa.string()),
+                ("refs", pa.string()),
+            ]
+        )
+        cols: Dict[str, List] = {name: [] for name in schema.names}
+
+        with self._open_objects("rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    obj = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+
+                geom = obj.get("geom") or {}
+                cols["changeset_id"].append(obj.get("changeset_id"))
+                cols["action"].append(obj.get("action"))
+                cols["obj_type"].append(obj.get("obj_type"))
+                cols["obj_id"].append(obj.get("obj_id"))
+                cols["version"].append(obj.get("version"))
+                cols["timestamp"].append(obj.get("timestamp"))
+                cols["visible"].append(obj.get("visible"))
+                cols["user"].append(obj.get("user"))
+                cols["uid"].append(obj.get("uid"))
+                cols["lat"].append(geom.get("lat"))
+                cols["lon"].append(geom.get("lon"))
+                tags = obj.get("tags")
+                cols["tags"].append(orjson.dumps(tags).decode() if tags else None)
+                refs = obj.get("refs")
+                cols["refs"].append(orjson.dumps(refs).decode() if refs else None)
+
+        table = pa.Table.from_pydict(cols, schema=schema)
+        pq.write_table(table, out_path, compression="zstd")
+        logger.info(f"Exported {table.num_rows} objects to {out_path}")
+        return out_path
+
+    # 워커 스레드용: 다운로드 + 파싱 + 직렬화까지 스레드에서 끝낸다.
+    # lxml 파싱과 orjson 직렬화는 GIL을 풀어주므로 네트워크 대기와 실제로 겹쳐 돈다
+    def _fetch_and_parse(self, cs_id: int) -> Tuple[Optional[List[Dict]], bytes]:
+        xml_data = self.download_changeset(cs_id)
+        if not xml_data:
+            return None, b""
+        objects = self.extract_objects(cs_id, xml_data)
+        if objects is None:
+            return None, b""
+        buf = b"".join(orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE) for obj in objects)
+        return objects, buf
+
     # 이미 처리된 changeset 스킵 + 누적 저장
-    def process_changesets(self, changeset_ids: List[int], overwrite: bool = False):
+    def process_changesets(self, changeset_ids: List[int], overwrite: bool = False,
+                           export_parquet: bool = False):
         # overwrite 모드면 누적 파일 초기화
         if overwrite:
+            if self._queue_conn is not None:
+                self._queue_conn.close()
+                self._queue_conn = None
             if self.objects_file.exists():
                 self.objects_file.unlink()
             if self.queue_file.exists():
                 self.queue_file.unlink()
+            if self.queue_db.exists():
+                self.queue_db.unlink()
             if self.processed_file.exists():
                 self.processed_file.unlink()
 
         processed = self._load_processed_changesets()
 
+        # 큐 db를 열어두고(필요 시 기존 CSV 이관), 새 객체는 추출 직후 바로 적재한다
+        self._open_queue_db()
+
         total_objects = 0
-        skipped = 0
         done = 0
         failed = 0
 
-        for cs_id in changeset_ids:
-            # 이미 처리한 changeset이면 스킵
-            if cs_id in processed:
-                skipped += 1
-                continue
-
-            objects = self.extract_objects(cs_id)
-
-            # 실패(None)면 processed에 기록하지 않음 (다음 실행에서 재시도 가능)
-            if objects is None:
-                failed += 1
-                logger.warning(f"Failed changeset (will retry later): {cs_id}")
-                continue
-
-            if objects:
-                self.save_objects(objects)
-                total_objects += len(objects)
-
-            # 성공했을 때만 처리 완료 changeset 기록
-            self._mark_processed(cs_id)
-            processed.add(cs_id)
-            done += 1
+        # 이미 처리한 changeset은 미리 걸러낸다
+        pending = [cs_id for cs_id in changeset_ids if cs_id not in processed]
+        skipped = len(changeset_ids) - len(pending)
+
+        # 다운로드+파싱+직렬화는 스레드 풀에서 동시에, 쓰기/기록은 메인 스레드 하나가 담당.
+        # futures를 제출 순서대로 소비하므로 objects.jsonl의 행 순서는
+        # 직렬 실행과 동일하게 유지된다.
+        # 출력 파일 두 개는 한 번만 열어두고, 100개 changeset마다 디스크로 내려보낸다.
+        self._objects_fh = self._open_objects("ab")
+        self._processed_fh = self.processed_file.open("a", encoding="utf-8")
+        since_sync = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for start in range(0, len(pending), self.batch_size):
+                    batch = pending[start:start + self.batch_size]
+                    futures = [pool.submit(self._fetch_and_parse, cs_id) for cs_id in batch]
+
+                    for cs_id, future in zip(batch, futures):
+                        # 같은 id가 입력에 중복으로 들어온 경우 대비
+                        if cs_id in processed:
+                            skipped += 1
+                            continue
+
+                        objects, buf = future.result()
+
+                        # 실패(None)면 processed에 기록하지 않음 (다음 실행에서 재시도 가능)
+                        if objects is None:
+                            failed += 1
+                            logger.warning(f"Failed changeset (will retry later): {cs_id}")
+                            continue
+
+                        if objects:
+                            self.save_objects(objects, buf)
+                            self._enqueue_prev_fetches(objects)
+                            total_objects += len(objects)
+
+                        # 성공했을 때만 처리 완료 changeset 기록
+                        self._mark_processed(cs_id)
+                        processed.add(cs_id)
+                        done += 1
+
+                        # 주기적 체크포인트 (중단돼도 직전 sync까지는 디스크에 남는다)
+                        since_sync += 1
+                        if since_sync >= 100:
+                            for fh in (self._objects_fh, self._processed_fh):
+                                fh.flush()
+                                os.fsync(fh.fileno())
+                            self._queue_conn.commit()
+                            since_sync = 0
+        finally:
+            for fh in (self._objects_fh, self._processed_fh):
+                fh.flush()
+                os.fsync(fh.fileno())
+                fh.close()
+            self._objects_fh = None
+            self._processed_fh = None
+            self._queue_conn.commit()
 
         logger.info(
             f"Done={done}, Skipped={skipped}, Failed={failed}, "
             f"TotalObjectsAdded={total_objects}, InputChangesets={len(changeset_ids)}"
         )
 
-        # queue는 전체 objects.jsonl 기준으로 재생성
-        self.generate_fetch_queue()
\ No newline at end of file
+        # 추출 중에 적재한 큐(기존 CSV + 이번 실행분)를 저장
+        self.generate_fetch_queue()
+
+        # 요청 시 분석용 Parquet 사이드카도 갱신
+        if export_parquet:
+            self.export_parquet()
\ No newline at end of file
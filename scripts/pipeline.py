@@ -1,9 +1,8 @@
 import argparse
-import csv
 from pathlib import Path
 from typing import List, Optional
 
-from objects_extractor import ChangesetObjectExtractor
+from objects_extractor import ChangesetObjectExtractor, load_changeset_ids
 from object_version_extractor import ObjectVersionExtractor
 
 
@@ -13,31 +12,6 @@ DATASET_PATHS = {
 }
 
 
-def load_changeset_ids(path: Path) -> List[int]:
-    if not path.exists():
-        raise FileNotFoundError(f"Dataset file not found: {path}")
-
-    delimiter = "\t" if path.suffix.lower() in [".tsv", ".tab"] else ","
-    ids: List[int] = []
-
-    with path.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f, delimiter=delimiter)
-
-        if not reader.fieldnames or "changeset" not in reader.fieldnames:
-            raise ValueError(f"'changeset' column not found in {path}")
-
-        for row in reader:
-            raw = (row.get("changeset") or "").strip()
-            if not raw:
-                continue
-            try:
-                ids.append(int(raw))
-            except ValueError:
-                continue
-
-    return list(dict.fromkeys(ids))
-
-
 def slice_ids(ids: List[int], start: int, end: Optional[int]) -> List[int]:
     if start < 0:
         start = 0